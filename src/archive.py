@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compact plan archive:
+Stores every plan sampled by a Markov chain so that new metrics can be computed
+offline, without rerunning the chain.
+
+Format:
+An archive at `path` is made of three files.
+    {path}.bin   a byte stream of records, one per step, each padded to 4 bytes.
+                 Keyframes hold the full `uint8` assignment vector; every other
+                 step only holds the reassigned node indices (`uint32`) followed
+                 by their new district codes (`uint8`).
+    {path}.idx   an `int64` (offset, count) pair per step pointing into the byte stream.
+    {path}.json  the node order, the district labels and the keyframe interval.
+
+A ReCom step only reassigns nodes between two districts, so the deltas are small,
+and a keyframe every KEYFRAME_INTERVAL steps keeps random access fast.
+"""
+import json
+import multiprocessing
+import os
+
+import numpy as np
+
+KEYFRAME_INTERVAL = 1000
+
+_INDEX_DTYPE = np.dtype("<i8")
+_NODE_DTYPE = np.dtype("<u4")
+
+
+def _padding(nbytes):
+    return -nbytes % 4
+
+
+def _to_json(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+class _GrowableMemmap:
+    """
+    A 1-d memory-mapped array that is appended to in place and doubles its file
+    when it runs out of room. close() trims the file to the written size.
+    """
+
+    def __init__(self, path, dtype, capacity=1 << 16):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.size = 0
+        self._array = np.memmap(path, dtype=self.dtype, mode="w+", shape=(capacity,))
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=self.dtype)
+        end = self.size + len(values)
+        if end > len(self._array):
+            self._grow(end)
+        self._array[self.size : end] = values
+        self.size = end
+
+    def _grow(self, needed):
+        capacity = max(needed, 2 * len(self._array))
+        self._array.flush()
+        del self._array
+        # np.memmap extends the file when opened in r+ mode with a larger shape
+        self._array = np.memmap(self.path, dtype=self.dtype, mode="r+", shape=(capacity,))
+
+    def close(self):
+        if self._array is None:
+            return
+        self._array.flush()
+        self._array = None
+        os.truncate(self.path, self.size * self.dtype.itemsize)
+
+
+def _open_readonly(path, dtype):
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r")
+
+
+class PlanArchiveWriter:
+    """
+    PlanArchiveWriter class
+
+    Streams the plans yielded by a Markov chain into a plan archive. Call append()
+    with every partition the chain yields, starting with the initial one, then close(),
+    or use the writer as a context manager so that a failed run still leaves a readable
+    archive of the plans appended so far.
+    """
+
+    def __init__(self, path, initial_partition, keyframe_interval=KEYFRAME_INTERVAL):
+        self.path = path
+        self.keyframe_interval = keyframe_interval
+        self.nodes = list(initial_partition.graph.nodes)
+        self.labels = sorted(initial_partition.parts.keys())
+        if len(self.labels) > 256:
+            raise ValueError("a plan archive holds at most 256 districts")
+
+        self._index_of = {node: i for i, node in enumerate(self.nodes)}
+        self._code_of = {label: code for code, label in enumerate(self.labels)}
+        self._current = self._vector(initial_partition)
+        self._last = None
+        self.num_steps = 0
+        self.closed = False
+
+        self._data = _GrowableMemmap(f"{path}.bin", np.uint8, capacity=1 << 20)
+        self._index = _GrowableMemmap(f"{path}.idx", _INDEX_DTYPE)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _vector(self, partition):
+        assignment = partition.assignment
+        return np.fromiter(
+            (self._code_of[assignment[node]] for node in self.nodes),
+            dtype=np.uint8,
+            count=len(self.nodes),
+        )
+
+    def _changes(self, partition):
+        """
+        Returns the node indices and district codes that differ between the
+        previously appended plan and this one.
+        """
+        if partition is self._last:
+            # a rejected proposal: the chain yields the same state again
+            return np.zeros(0, dtype=_NODE_DTYPE), np.zeros(0, dtype=np.uint8)
+
+        flips = getattr(partition, "flips", None)
+        if self._last is not None and partition.parent is self._last and flips:
+            ids = np.fromiter(
+                (self._index_of[node] for node in flips), dtype=_NODE_DTYPE, count=len(flips)
+            )
+            codes = np.fromiter(
+                (self._code_of[label] for label in flips.values()),
+                dtype=np.uint8,
+                count=len(flips),
+            )
+            # ReCom flips every node of the two merged districts, keep the moved ones
+            moved = self._current[ids] != codes
+            return ids[moved], codes[moved]
+
+        vector = self._vector(partition)
+        ids = np.flatnonzero(vector != self._current).astype(_NODE_DTYPE)
+        return ids, vector[ids]
+
+    def append(self, partition):
+        ids, codes = self._changes(partition)
+        self._current[ids] = codes
+        self._last = partition
+
+        offset = self._data.size
+        if self.num_steps % self.keyframe_interval == 0:
+            record = [self._current]
+            count = len(self._current)
+        else:
+            record = [ids.view(np.uint8), codes]
+            count = len(ids)
+        nbytes = sum(len(part) for part in record)
+        record.append(np.zeros(_padding(nbytes), dtype=np.uint8))
+
+        self._data.extend(np.concatenate(record))
+        self._index.extend([offset, count])
+        self.num_steps += 1
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._data.close()
+        self._index.close()
+        meta = {
+            "nodes": [_to_json(node) for node in self.nodes],
+            "labels": [_to_json(label) for label in self.labels],
+            "keyframe_interval": self.keyframe_interval,
+            "num_steps": self.num_steps,
+        }
+        with open(f"{self.path}.json", "w") as f_out:
+            json.dump(meta, f_out)
+
+
+class PlanArchive:
+    """
+    PlanArchive class
+
+    Read-only, memory-mapped view of a plan archive. Assignment vectors hold the
+    district code of every node in archive.nodes order; archive.labels maps the
+    codes back to district labels.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(f"{path}.json") as f_in:
+            meta = json.load(f_in)
+        self.nodes = meta["nodes"]
+        self.labels = meta["labels"]
+        self.keyframe_interval = meta["keyframe_interval"]
+
+        self._data = _open_readonly(f"{path}.bin", np.uint8)
+        self._index = _open_readonly(f"{path}.idx", _INDEX_DTYPE).reshape(-1, 2)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __getitem__(self, step):
+        return self.assignment(step)
+
+    def __iter__(self):
+        for _, vector in self.iter_assignments():
+            yield vector.copy()
+
+    def _check_step(self, step):
+        if step < 0:
+            step += len(self)
+        if not 0 <= step < len(self):
+            raise IndexError(f"step {step} out of range for {len(self)} archived plans")
+        return step
+
+    def _apply(self, vector, step):
+        offset, count = self._index[step]
+        if step % self.keyframe_interval == 0:
+            vector[:] = self._data[offset : offset + count]
+        else:
+            ids_end = offset + count * _NODE_DTYPE.itemsize
+            ids = self._data[offset:ids_end].view(_NODE_DTYPE)
+            vector[ids] = self._data[ids_end : ids_end + count]
+
+    def assignment(self, step):
+        """
+        assignment: returns the assignment vector of the plan at the given step,
+                    replayed from the closest preceding keyframe.
+        """
+        step = self._check_step(step)
+        vector = np.empty(len(self.nodes), dtype=np.uint8)
+        for s in range(step - step % self.keyframe_interval, step + 1):
+            self._apply(vector, s)
+        return vector
+
+    def iter_assignments(self, start=0, stop=None):
+        """
+        iter_assignments: yields (step, assignment vector) for every step in [start, stop),
+                          applying one delta per step. The yielded vector is reused
+                          between steps, copy it to keep it. Negative start and stop
+                          count from the end, as in slicing.
+        """
+        start, stop, _ = slice(start, stop).indices(len(self))
+        if start >= stop:
+            return
+        vector = self.assignment(start)
+        yield start, vector
+        for step in range(start + 1, stop):
+            self._apply(vector, step)
+            yield step, vector
+
+    def to_dict(self, vector):
+        """
+        to_dict: converts an assignment vector to a {node: district label} dictionary.
+        """
+        return {node: self.labels[code] for node, code in zip(self.nodes, vector)}
+
+    def partition(self, step, graph, updaters=None):
+        """
+        partition: rebuilds the archived plan at the given step as a gerrychain Partition.
+        """
+        from gerrychain import Partition
+
+        return Partition(graph, assignment=self.to_dict(self.assignment(step)), updaters=updaters)
+
+
+def _map_chunk(path, func, start, stop):
+    archive = PlanArchive(path)
+    return [func(vector) for _, vector in archive.iter_assignments(start, stop)]
+
+
+def map_archive(path, func, processes=None):
+    """
+    map_archive: computes func(assignment vector) for every archived plan in parallel
+                 and returns the results in step order. Work is split on keyframes so
+                 every process replays its own range of steps. func must be picklable,
+                 i.e. defined at module level.
+    """
+    archive = PlanArchive(path)
+    interval = archive.keyframe_interval
+    chunks = [
+        (path, func, start, min(start + interval, len(archive)))
+        for start in range(0, len(archive), interval)
+    ]
+    with multiprocessing.Pool(processes=processes) as pool:
+        results = pool.starmap(_map_chunk, chunks)
+    return [value for chunk in results for value in chunk]
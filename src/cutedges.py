@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Incremental cut edge counting:
+The compactness constraint of config_markov_chain and the ensemble recorder of main.py only
+need the number of cut edges, not the set of cut edges. CutEdgeCount keeps the graph as a
+CSR edge list (indptr / indices arrays over the node order) and updates the parent's count
+from the edges incident to the reassigned nodes only, so a step costs time proportional to
+the size of the move rather than the number of edges in the graph.
+"""
+from collections import OrderedDict
+
+import numpy as np
+
+# number of recent partitions whose count is kept to update their children from
+CACHE_SIZE = 256
+
+
+class CutEdgeCount:
+    """
+    CutEdgeCount class
+
+    A gerrychain updater returning the number of cut edges of a partition. Install it on a
+    partition as partition.updaters["cut_edge_count"] = CutEdgeCount(partition.graph), the
+    graph of the partition carrying the node ids its assignment uses.
+    """
+
+    def __init__(self, graph, alias="cut_edge_count"):
+        self.alias = alias
+        self.nodes = list(graph.nodes)
+        self._index_of = {node: i for i, node in enumerate(self.nodes)}
+
+        degrees = np.fromiter(
+            (graph.degree(node) for node in self.nodes), dtype=np.int64, count=len(self.nodes)
+        )
+        self.indptr = np.zeros(len(self.nodes) + 1, dtype=np.int64)
+        np.cumsum(degrees, out=self.indptr[1:])
+        self.indices = np.fromiter(
+            (self._index_of[v] for u in self.nodes for v in graph.neighbors(u)),
+            dtype=np.int64,
+            count=self.indptr[-1],
+        )
+        # id(partition) -> (partition, count), the partition is kept so its id isn't reused
+        self._counts = OrderedDict()
+
+    def __call__(self, partition):
+        parent = partition.parent
+        entry = self._counts.get(id(parent)) if parent is not None else None
+        if entry is not None and entry[0] is parent and partition.flips is not None:
+            self._counts.move_to_end(id(parent))
+            count = entry[1] + self.delta(parent.assignment, partition.assignment, partition.flips)
+        else:
+            count = self.count(partition)
+
+        self._counts[id(partition)] = (partition, count)
+        self._counts.move_to_end(id(partition))
+        if len(self._counts) > CACHE_SIZE:
+            self._counts.popitem(last=False)
+        return count
+
+    def count(self, partition):
+        """
+        count: counts the cut edges of a partition from scratch.
+        """
+        assignment = partition.assignment
+        districts = np.array([assignment[node] for node in self.nodes])
+        rows = np.repeat(np.arange(len(self.nodes)), np.diff(self.indptr))
+        # every edge appears once from each of its endpoints
+        return int(np.count_nonzero(districts[rows] != districts[self.indices])) // 2
+
+    def delta(self, old, new, flips):
+        """
+        delta: change in the number of cut edges between the old and the new assignment,
+               looking only at the edges incident to the flipped nodes that changed district.
+        """
+        moved = {self._index_of[node] for node, part in flips.items() if old[node] != part}
+
+        change = 0
+        for i in moved:
+            u = self.nodes[i]
+            for j in self.indices[self.indptr[i] : self.indptr[i + 1]].tolist():
+                if j in moved and j < i:
+                    # edge between two moved nodes, already counted from j
+                    continue
+                v = self.nodes[j]
+                change += int(new[u] != new[v]) - int(old[u] != old[v])
+        return change
@@ -22,6 +22,8 @@ from functools import partial, reduce
 import numpy as np
 import random
 
+from cutedges import CutEdgeCount
+
 
 def config_markov_chain(
     initial_part,
@@ -40,8 +42,11 @@ def config_markov_chain(
     )
 
     if compactness:
+        # the updaters are shared by every partition derived from initial_part
+        if "cut_edge_count" not in initial_part.updaters:
+            initial_part.updaters["cut_edge_count"] = CutEdgeCount(initial_part.graph)
         compactness_bound = constraints.UpperBound(
-            lambda p: len(p["cut_edges"]), 2 * len(initial_part["cut_edges"])
+            lambda p: p["cut_edge_count"], 2 * initial_part["cut_edge_count"]
         )
         cs = [
             constraints.within_percent_of_ideal_population(initial_part, epsilon),
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Figure rendering:
+Renders the analysis figures of main.py from the metric arrays recorded during a run.
+The figures are independent of each other, so they are drawn concurrently in a process
+pool with the non-interactive Agg backend, and every figure is closed once saved.
+
+A run saved by main.py can be rendered again without rerunning the chain:
+    python3 render.py ../data/OH_dists15_TOTPOP_2.0%_ensemble_20000_metrics.npz [output_dir]
+"""
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+from utils import bcolors, load_run
+
+OUTPUT_DIR = "../output"
+
+
+def _histogram(filename, values, initial, xlabel, ylabel, title, align="mid"):
+    fig, ax = plt.subplots()
+    ax.hist(values, align=align)
+    ax.axvline(initial, color="red", linestyle="--")
+    ax.legend(["Initial partition value"])
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    ax.set_title(title)
+    fig.savefig(filename)
+    plt.close(fig)
+
+
+def _bar(filename, values, initial, xlabel, ylabel, title):
+    fig, ax = plt.subplots()
+    labels, counts = np.unique(values, return_counts=True)
+    ax.bar(labels, counts, align="center")
+    ax.set_xticks(labels)
+    ax.axvline(initial, color="red", linestyle="--")
+    ax.legend(["Initial partition value"])
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    ax.set_title(title)
+    fig.savefig(filename)
+    plt.close(fig)
+
+
+def _marginal_box(filename, values, ylabel, title):
+    # values has one row per step and one column per sorted district
+    fig, ax = plt.subplots(figsize=(8, 6))
+    positions = range(values.shape[1])
+    ax.axhline(0.5, color="#ff0000", linestyle="--")
+    ax.boxplot(values, positions=positions)
+    ax.plot(positions, values[0], "ro")
+    ax.grid(True)
+
+    # Annotate
+    ax.set_title(title)
+    ax.set_ylabel(ylabel)
+    ax.set_xlabel("Sorted districts")
+    ax.set_ylim(0, 1)
+    ax.set_yticks([0, 0.25, 0.5, 0.75, 1])
+    fig.savefig(filename)
+    plt.close(fig)
+
+
+# (renderer, output file, metric, keyword arguments)
+FIGURES = [
+    (
+        _histogram,
+        "cut_edges.png",
+        "cut_edges",
+        dict(
+            xlabel="Number of cut edges",
+            ylabel="Frequency",
+            title="Number of cut edges by plans",
+            align="left",
+        ),
+    ),
+    (
+        _bar,
+        "dem_pres16.png",
+        "dem_won_pres",
+        dict(
+            xlabel="Number of districts",
+            ylabel="Steps",
+            title="Districts won by Democrats in 2016 presidential election",
+        ),
+    ),
+    (
+        _bar,
+        "dem_sen16.png",
+        "dem_won_sen",
+        dict(
+            xlabel="Number of districts",
+            ylabel="Steps",
+            title="Districts won by Democrats in 2016 senatorial election",
+        ),
+    ),
+    (
+        _histogram,
+        "mean_median_pres16.png",
+        "mean_median_pres",
+        dict(
+            xlabel="Mean-median difference",
+            ylabel="Steps",
+            title="Mean-median difference for Dem presidential election in 2016",
+        ),
+    ),
+    (
+        _histogram,
+        "mean_median_sen16.png",
+        "mean_median_sen",
+        dict(
+            xlabel="Mean-median difference",
+            ylabel="Steps",
+            title="Mean-median difference for Dem senatorial election in 2016",
+        ),
+    ),
+    (
+        _histogram,
+        "efficiency_gap_pres16.png",
+        "efficiency_gap_pres",
+        dict(
+            xlabel="Efficiency gap",
+            ylabel="Steps",
+            title="Efficiency gap for Dem presidential election in 2016",
+        ),
+    ),
+    (
+        _histogram,
+        "efficiency_gap_sen16.png",
+        "efficiency_gap_sen",
+        dict(
+            xlabel="Efficiency gap",
+            ylabel="Steps",
+            title="Efficiency gap for Dem senatorial election in 2016",
+        ),
+    ),
+    (
+        _marginal_box,
+        "marginal_pres16.png",
+        "wins_by_district_pres16",
+        dict(
+            ylabel="Democratic vote % (President 2016)",
+            title="Marginal box plot for Democrats presidential wins in 2016",
+        ),
+    ),
+    (
+        _marginal_box,
+        "marginal_sen16.png",
+        "wins_by_district_sen16",
+        dict(
+            ylabel="Democratic vote % (Senate 2016)",
+            title="Marginal box plot for Democrats senatorial wins in 2016",
+        ),
+    ),
+]
+
+
+def render_run(run, output_dir=OUTPUT_DIR, processes=None):
+    """
+    render_run: renders every figure of a run concurrently.
+    args:
+        run:        dictionary of metric arrays, or the path of a run saved by save_run
+        output_dir: directory the figures are saved to
+        processes:  number of rendering processes, defaults to one per figure
+    """
+    if isinstance(run, str):
+        run = load_run(run)
+    os.makedirs(output_dir, exist_ok=True)
+
+    with ProcessPoolExecutor(max_workers=processes or len(FIGURES)) as pool:
+        futures = {}
+        for renderer, filename, metric, kwargs in FIGURES:
+            if renderer is not _marginal_box:
+                kwargs = dict(kwargs, initial=run[f"initial_{metric}"])
+            values = np.asarray(run[metric])
+            future = pool.submit(renderer, f"{output_dir}/{filename}", values, **kwargs)
+            futures[future] = filename
+
+        for future, filename in futures.items():
+            future.result()
+            print(f"{bcolors.OKPINK}🎨 Rendered {filename}{bcolors.ENDC}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit(f"usage: {sys.argv[0]} RUN.npz [OUTPUT_DIR]")
+
+    start_time = time.time()
+    render_run(sys.argv[1], *sys.argv[2:3])
+    print(
+        f"\n{bcolors.OKGREEN}✅ The time to render the figures is {time.time() - start_time} seconds{bcolors.ENDC}"
+    )
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Experiment runner:
+Runs a batch of experiments described by a JSON config in one warm process. The graph is
+loaded once, the short burst and biased runs share a single multiprocessing pool whose
+workers receive the graph once, and the ensembles run in the main process while the pool
+works. main.py, sb.py and their dependencies are only imported when an experiment needs them.
+
+Config:
+    {
+        "shapefile": "../data/Ohio.shp",    (optional)
+        "processes": 20,                    (optional, size of the pool)
+        "experiments": [
+            {"type": "ensemble", ...keyword arguments of main.run_ensemble},
+            {"type": "short_burst", "thresholds": [...], "burst_lens": [...],
+             "score_functs": [...] (optional), "replicates": 5 (optional),
+             ...keyword arguments of sb.sb_worker},
+            {"type": "biased", "thresholds": [...], "p": 0.25,
+             "burst_lens": [...] (optional), ...keyword arguments of sb.biased_worker}
+        ]
+    }
+
+Usage:
+    python3 runner.py experiments.json
+"""
+import json
+import multiprocessing
+import sys
+import time
+
+from utils import SHAPEFILE, bcolors, load_graph
+
+
+def grid_tasks(experiment):
+    """
+    grid_tasks: expands a short_burst or biased experiment into (worker name, keyword arguments)
+                tasks, one per threshold, burst length, score function and replicate.
+    """
+    kwargs = dict(experiment)
+    kind = kwargs.pop("type")
+    thresholds = kwargs.pop("thresholds")
+    score_funct = kwargs.pop("score_funct", None)
+    score_functs = kwargs.pop("score_functs", None)
+    if score_funct is not None and score_functs is not None:
+        raise ValueError("give either score_funct or score_functs, not both")
+    if score_functs is None:
+        score_functs = [score_funct]
+    replicates = kwargs.pop("replicates", None)
+    replicates = [None] if replicates is None else range(replicates)
+
+    if kind == "short_burst":
+        burst_lens = kwargs.pop("burst_lens")
+        worker = "sb_worker"
+    elif kind == "biased":
+        burst_lens = kwargs.pop("burst_lens", [None])
+        worker = "biased_worker"
+    else:
+        raise ValueError(f"unknown experiment type: {kind}")
+
+    tasks = []
+    for score_funct in score_functs:
+        for threshold in thresholds:
+            for burst_len in burst_lens:
+                for replicate in replicates:
+                    task = dict(kwargs, threshold=threshold, burst_len=burst_len, replicate=replicate)
+                    if score_funct is not None:
+                        task["score_funct"] = score_funct
+                    tasks.append((worker, task))
+    return tasks
+
+
+def run_experiments(config):
+    start_time = time.time()
+
+    ensembles = [e for e in config["experiments"] if e["type"] == "ensemble"]
+    tasks = [
+        task
+        for e in config["experiments"]
+        if e["type"] != "ensemble"
+        for task in grid_tasks(e)
+    ]
+
+    if ensembles:
+        import main
+
+        names = [main.ensemble_name(**e) for e in ensembles]
+        duplicates = sorted({n for n in names if names.count(n) > 1})
+        if duplicates:
+            raise ValueError(f"ensembles would overwrite each other's files: {duplicates}")
+
+    graph = load_graph(config.get("shapefile", SHAPEFILE))
+
+    pool = None
+    results = []
+    failures = []
+    try:
+        if tasks:
+            import sb
+
+            pool = multiprocessing.Pool(
+                processes=config.get("processes"),
+                initializer=sb.init_worker,
+                initargs=(graph,),
+            )
+            results = [
+                (worker, kwargs, pool.apply_async(getattr(sb, worker), kwds=kwargs))
+                for worker, kwargs in tasks
+            ]
+            pool.close()
+
+        for experiment in ensembles:
+            kwargs = dict(experiment)
+            kwargs.pop("type")
+            try:
+                main.run_ensemble(graph, **kwargs)
+            except Exception as e:
+                failures.append(("ensemble", kwargs, e))
+
+        # wait for every task, one failure must not cancel the others
+        for worker, kwargs, result in results:
+            try:
+                print(f"{bcolors.OKGREEN}🎉 Saved {result.get()}{bcolors.ENDC}", flush=True)
+            except Exception as e:
+                failures.append((worker, kwargs, e))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    for kind, kwargs, error in failures:
+        print(f"{bcolors.FAIL}❌ {kind} {kwargs} failed: {error!r}{bcolors.ENDC}", flush=True)
+
+    print(
+        f"\n{bcolors.OKGREEN}✅ The time to run {len(ensembles) + len(tasks)} experiments is {time.time() - start_time} seconds{bcolors.ENDC}"
+    )
+    return failures
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit(f"usage: {sys.argv[0]} CONFIG.json")
+
+    with open(sys.argv[1]) as f_in:
+        failures = run_experiments(json.load(f_in))
+    if failures:
+        sys.exit(f"{len(failures)} experiments failed")
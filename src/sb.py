@@ -6,22 +6,24 @@ This code is based on the code:  https://github.com/vrdi/shortbursts-gingles/blo
 
 Multi-processing:
 To speed up the process, we use the multiprocessing library to run the short bursts in parallel.
-The number of processes is defined by the MAX_PROCESSES variable.
+The number of processes is defined by the MAX_PROCESSES variable. The graph is loaded once and
+handed to every process of the pool through init_worker.
 
 Minority Population:
 The minority population is defined by the MIN_POP_COL variable. In this case, we are using the Black Voting Age Population (BVAP).
 This is because in Ohio, the BVAP is the minority population that has the most significant impact on the electoral results, especially in district 11
 where the BVAP is slightly more than the White Voting Age Population (WVAP).
 """
-import geopandas as gpd
 import numpy as np
+import os
 import pickle
-from gerrychain import Graph, Partition
+import tempfile
+from gerrychain import Partition
 from gerrychain.updaters import Tally
 from gingleator import Gingleator
 import multiprocessing
 
-from utils import bcolors
+from utils import bcolors, load_graph
 
 
 
@@ -32,52 +34,115 @@ POP_COL = "TOTPOP"
 MIN_POP_COL = "BVAP"
 POP_TOT = 0.02
 
-BURST_LENS = [5, 10, 15] 
-SCORE_FUNCT = Gingleator.num_opportunity_dists 
-THRESHOLDS = [0.4, 0.45, 0.5] 
+BURST_LENS = [5, 10, 15]
+SCORE_FUNCT = Gingleator.num_opportunity_dists
+THRESHOLDS = [0.4, 0.45, 0.5]
 ITERS = 20000
 
 # to run in parallel
-MAX_PROCESSES = 20 
+MAX_PROCESSES = 20
 
-print(f"{bcolors.OKCYAN}🚚 Loading the data...{bcolors.ENDC}")
-ohio = gpd.read_file("../data/Ohio.shp")
-graph = Graph.from_geodataframe(ohio)
+DATA_DIR = "../data"
 
+# set in every process of the pool by init_worker
+graph = None
 
-my_updaters = {"population" : Tally(POP_COL, alias="population"),
-               "VAP": Tally("VAP"),
-               "BVAP": Tally("BVAP")}
+
+def init_worker(state_graph):
+    """
+    Pool initializer that keeps the graph in the worker process, so that the
+    graph is loaded once rather than once per task.
+    """
+    global graph
+    graph = state_graph
 
 
-print(f"{bcolors.OKCYAN}🏗️  Creating an initial partition...{bcolors.ENDC}")
-initial_partition = Partition(
-    graph=graph,
-    assignment="CONG_DIST",
-    updaters=my_updaters
-)
+def make_initial_partition(pop_col=POP_COL, min_pop_col=MIN_POP_COL):
+    """
+    Creates the enacted plan partition with the population, VAP and minority VAP tallies.
+    """
+    my_updaters = {"population" : Tally(pop_col, alias="population"),
+                   "VAP": Tally("VAP"),
+                   min_pop_col: Tally(min_pop_col)}
 
+    print(f"{bcolors.OKCYAN}🏗️  Creating an initial partition...{bcolors.ENDC}")
+    return Partition(
+        graph=graph,
+        assignment="CONG_DIST",
+        updaters=my_updaters
+    )
 
-def sb_worker(threshold, burst_len):
+
+def write_atomically(path, write):
+    """
+    Calls write(f_out) on a temporary file next to path, then moves it into place, so that
+    a process killed mid-write or two processes writing the same results never leave a
+    truncated file behind.
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f_out:
+            write(f_out)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def save_results(params, sb_obs, min_pop_col=MIN_POP_COL, out_dir=DATA_DIR):
+    """
+    Saves the observed scores and the VAP / minority VAP of the best plan under {out_dir}/{params}.
+    """
+    print(f"{bcolors.OKCYAN}📊 Saving the results...{bcolors.ENDC}")
+
+    f_out_res = f"{out_dir}/{params}.npy"
+    write_atomically(f_out_res, lambda f_out: np.save(f_out, sb_obs[1]))
+
+    f_out_stats = f"{out_dir}/{params}.p"
+    max_stats = {"VAP": sb_obs[0][0]["VAP"],
+                 min_pop_col: sb_obs[0][0][min_pop_col]}
+
+    write_atomically(f_out_stats, lambda f_out: pickle.dump(max_stats, f_out))
+
+
+def make_gingleator(threshold, score_funct, min_pop_col, pop_col, pop_tot):
+    if isinstance(score_funct, str):
+        score_funct = getattr(Gingleator, score_funct)
+
+    gingles = Gingleator(make_initial_partition(pop_col, min_pop_col), pop_col=pop_col,
+                         threshold=threshold, score_funct=score_funct, epsilon=pop_tot,
+                         minority_perc_col="{}_perc".format(min_pop_col))
+
+    gingles.init_minority_perc_col(min_pop_col, "VAP", "{}_perc".format(min_pop_col))
+    return gingles
+
+
+def sb_worker(threshold, burst_len, iters=ITERS, score_funct=SCORE_FUNCT,
+              min_pop_col=MIN_POP_COL, pop_col=POP_COL, pop_tot=POP_TOT,
+              replicate=None, out_dir=DATA_DIR):
     """
     A worker function that runs the short bursts for a given threshold and burst length.
-    Intended to be used in a multiprocessing pool.
+    Intended to be used in a multiprocessing pool initialized with init_worker.
 
     Parameters:
     threshold (float): The threshold for the short bursts.
     burst_len (int): The length of each burst.
+    iters (int): The total number of steps.
+    score_funct (function or str): A Gingleator score function, or its name.
+    min_pop_col (str): The minority voting age population column.
+    replicate (int): The replicate number, appended to the name of the results.
+    out_dir (str): The directory the results are saved to.
+
+    Returns:
+    str: The name of the saved results.
     """
-    params = f"{STATE}_dists{NUM_DISTRICTS}_{MIN_POP_COL}opt_{POP_TOT:.1%}_{ITERS}_sbl{burst_len}_score{SCORE_FUNCT.__name__}_{threshold}"
+    gingles = make_gingleator(threshold, score_funct, min_pop_col, pop_col, pop_tot)
+    params = f"{STATE}_dists{NUM_DISTRICTS}_{min_pop_col}opt_{pop_tot:.1%}_{iters}_sbl{burst_len}_score{gingles.score.__name__}_{threshold}"
+    if replicate is not None:
+        params += f"_r{replicate}"
 
-    
-    num_bursts = ITERS//burst_len
-    
-    gingles = Gingleator(initial_partition, pop_col=POP_COL,
-                         threshold=threshold, score_funct=SCORE_FUNCT, epsilon=POP_TOT,
-                         minority_perc_col="{}_perc".format(MIN_POP_COL))
 
-    
-    gingles.init_minority_perc_col(MIN_POP_COL, "VAP", "{}_perc".format(MIN_POP_COL))
+    num_bursts = iters//burst_len
 
     print(f"{bcolors.WARNING} Running short bursts for threshold = {threshold} and burst_len= {burst_len}{bcolors.ENDC}", flush=True)
 
@@ -86,18 +151,48 @@ def sb_worker(threshold, burst_len):
 
     print(f"{bcolors.OKGREEN}🎉 Short bursts completed!{bcolors.ENDC}", flush=True)
 
-    print(f"{bcolors.OKCYAN}📊 Saving the results...{bcolors.ENDC}")
+    save_results(params, sb_obs, min_pop_col, out_dir)
+    return params
 
-    f_out_res = f"../data/{params}.npy"
-    np.save(f_out_res, sb_obs[1])
 
-    f_out_stats = f"../data/{params}.p"
-    max_stats = {"VAP": sb_obs[0][0]["VAP"],
-                 "BVAP": sb_obs[0][0]["BVAP"]}
+def biased_worker(threshold, p=0.25, burst_len=None, iters=ITERS, score_funct=SCORE_FUNCT,
+                  min_pop_col=MIN_POP_COL, pop_col=POP_COL, pop_tot=POP_TOT,
+                  replicate=None, out_dir=DATA_DIR):
+    """
+    A worker function that runs a biased run, or biased short bursts when burst_len is given.
+    Intended to be used in a multiprocessing pool initialized with init_worker.
+
+    Parameters:
+    threshold (float): The threshold for the score function.
+    p (float): The probability of accepting a plan with a worse score.
+    burst_len (int): The length of each burst, None for a single biased run.
+    replicate (int): The replicate number, appended to the name of the results.
+    out_dir (str): The directory the results are saved to.
+
+    Returns:
+    str: The name of the saved results.
+    """
+    gingles = make_gingleator(threshold, score_funct, min_pop_col, pop_col, pop_tot)
+    run = "biased" if burst_len is None else f"bsbl{burst_len}"
+    params = f"{STATE}_dists{NUM_DISTRICTS}_{min_pop_col}opt_{pop_tot:.1%}_{iters}_{run}_p{p}_score{gingles.score.__name__}_{threshold}"
+    if replicate is not None:
+        params += f"_r{replicate}"
+
+    print(f"{bcolors.WARNING} Running {run} run for threshold = {threshold} and p = {p}{bcolors.ENDC}", flush=True)
+
+    if burst_len is None:
+        sb_obs = gingles.biased_run(num_iters=iters, p=p, maximize=True, verbose=True)
+    else:
+        sb_obs = gingles.biased_short_burst_run(num_bursts=iters//burst_len, num_steps=burst_len,
+                                                p=p, maximize=True)
+
+    print(f"{bcolors.OKGREEN}🎉 Biased run completed!{bcolors.ENDC}", flush=True)
+
+    save_results(params, sb_obs, min_pop_col, out_dir)
+    return params
 
-    with open(f_out_stats, "wb") as f_out:
-        pickle.dump(max_stats, f_out)
 
 if __name__ == '__main__':
-    with multiprocessing.Pool(processes=MAX_PROCESSES) as pool:
-        pool.starmap(sb_worker, [(th, bl) for th in THRESHOLDS for bl in BURST_LENS])
\ No newline at end of file
+    with multiprocessing.Pool(processes=MAX_PROCESSES, initializer=init_worker,
+                              initargs=(load_graph(),)) as pool:
+        pool.starmap(sb_worker, [(th, bl) for th in THRESHOLDS for bl in BURST_LENS])
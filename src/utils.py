@@ -11,3 +11,36 @@ class bcolors:
     ENDC = "\033[0m"
     BOLD = "\033[1m"
     UNDERLINE = "\033[4m"
+
+
+SHAPEFILE = "../data/Ohio.shp"
+
+
+def load_graph(shapefile=SHAPEFILE):
+    """
+    Loads the shapefile into a gerrychain Graph. geopandas and gerrychain are
+    imported here so that importing this module stays cheap.
+    """
+    import geopandas as gpd
+    from gerrychain import Graph
+
+    print(f"{bcolors.OKCYAN}🚚 Loading the data...{bcolors.ENDC}")
+    return Graph.from_geodataframe(gpd.read_file(shapefile))
+
+
+def save_run(path, metrics):
+    """
+    Saves the metric arrays of a run, along with their "initial_" values, so that
+    the figures can be rendered later.
+    """
+    import numpy as np
+
+    np.savez(path, **{key: np.asarray(value) for key, value in metrics.items()})
+
+
+def load_run(path):
+    """Loads the metric arrays of a run saved by save_run."""
+    import numpy as np
+
+    with np.load(path) as run:
+        return {key: run[key] for key in run.files}
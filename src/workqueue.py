@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Distributed work queue:
+Spreads short burst and biased sweeps (see runner.py) across several machines through a
+queue directory on a shared filesystem; ensembles are left to runner.py. Every task is a
+JSON file that moves between the state directories of the queue with atomic renames:
+
+    pending/  tasks waiting for a worker
+    leased/   tasks claimed by a worker, named after the task and the worker,
+              the file mtime is the lease heartbeat
+    done/     completed tasks along with the name of their results
+    failed/   tasks that failed MAX_ATTEMPTS times
+    results/  the .npy / .p files of every task, streamed in as tasks complete
+
+Workers load the graph once, then keep claiming tasks and renew their lease every
+HEARTBEAT_INTERVAL seconds. The coordinator returns the tasks of dead workers, whose
+lease has not been renewed for LEASE_TIMEOUT seconds, to pending/ and closes the queue
+once every task is done or failed. The coordinator and workers compare file mtimes
+with their own clock, so the machines' clocks should be kept in sync.
+
+Usage:
+    python3 workqueue.py submit QUEUE_DIR experiments.json
+    python3 workqueue.py coordinator QUEUE_DIR
+    python3 workqueue.py worker QUEUE_DIR [--processes N]
+    python3 workqueue.py local QUEUE_DIR experiments.json [--workers N]
+
+`local` is a single machine stand-in that submits the tasks, starts the workers as local
+processes and runs the coordinator.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import traceback
+
+from utils import SHAPEFILE, bcolors, load_graph
+
+LEASE_TIMEOUT = 300
+HEARTBEAT_INTERVAL = 30
+MAX_ATTEMPTS = 3
+POLL_INTERVAL = 5
+
+STATES = ("tmp", "pending", "leased", "done", "failed", "results")
+
+# suffixes of the leases taken out of leased/ into tmp/
+RELEASED_SUFFIXES = ("done", "failed", "expired")
+
+
+class WorkQueue:
+    """
+    WorkQueue class
+
+    A task queue stored in a directory. Tasks are dictionaries with an "id", the name of
+    the sb.py "worker" function to run, its "kwargs" and the number of "attempts".
+    """
+
+    def __init__(self, root, lease_timeout=LEASE_TIMEOUT, max_attempts=MAX_ATTEMPTS):
+        self.root = root
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        for state in STATES:
+            os.makedirs(os.path.join(root, state), exist_ok=True)
+
+    @property
+    def results_dir(self):
+        return os.path.join(self.root, "results")
+
+    @property
+    def closed(self):
+        return os.path.exists(os.path.join(self.root, "closed"))
+
+    def _path(self, state, task_id):
+        return os.path.join(self.root, state, f"{task_id}.json")
+
+    def _write(self, state, task):
+        # written aside then renamed, so that readers never see a partial task
+        tmp = self._path("tmp", f"{task['id']}.{os.getpid()}")
+        with open(tmp, "w") as f_out:
+            json.dump(task, f_out)
+        os.replace(tmp, self._path(state, task["id"]))
+
+    def _read(self, path):
+        with open(path) as f_in:
+            return json.load(f_in)
+
+    def _list(self, state):
+        return sorted(
+            name[: -len(".json")]
+            for name in os.listdir(os.path.join(self.root, state))
+            if name.endswith(".json")
+        )
+
+    def submit(self, tasks):
+        """
+        submit: adds (worker name, keyword arguments) tasks to the queue and reopens it.
+        """
+        prefix = f"{time.time_ns()}_{os.getpid()}"
+        for i, (worker, kwargs) in enumerate(tasks):
+            task = {"id": f"{prefix}_{i:05d}", "worker": worker, "kwargs": kwargs, "attempts": 0}
+            self._write("pending", task)
+
+        if self.closed:
+            os.remove(os.path.join(self.root, "closed"))
+        return len(tasks)
+
+    def claim(self, owner):
+        """
+        claim: leases the oldest pending task to owner, or returns None if there is none.
+               The lease is leased/{task id}.{owner}.json, so that a worker whose lease
+               expired can never renew or release another worker's lease of the same task.
+        """
+        for task_id in self._list("pending"):
+            pending = self._path("pending", task_id)
+            lease = f"{task_id}.{owner}"
+            leased = self._path("leased", lease)
+            try:
+                # the rename keeps the mtime, refresh it first so the lease isn't born expired
+                os.utime(pending)
+                os.rename(pending, leased)
+            except FileNotFoundError:
+                # claimed by another worker first
+                continue
+
+            try:
+                if os.path.exists(self._path("done", task_id)):
+                    # completed by a worker whose lease had expired
+                    self._remove(leased)
+                    continue
+                return dict(self._read(leased), lease=lease)
+            except FileNotFoundError:
+                # the lease expired and the coordinator already requeued the task
+                continue
+        return None
+
+    def renew(self, task):
+        """
+        renew: extends the lease of a task. Raises FileNotFoundError if the lease was lost.
+        """
+        os.utime(self._path("leased", task["lease"]))
+
+    def _release(self, task, suffix):
+        """
+        Takes the task's lease out of leased/, returns None if it was lost in the meantime.
+        """
+        released = self._path("tmp", f"{task['lease']}.{suffix}")
+        try:
+            os.rename(self._path("leased", task["lease"]), released)
+        except FileNotFoundError:
+            return None
+        return released
+
+    def complete(self, task, result):
+        """
+        complete: records the result of a task. Returns False, without recording anything,
+                  if the lease expired and the task was handed back to the queue.
+        """
+        released = self._release(task, "done")
+        if released is None:
+            return False
+        task = dict(task, result=result, host=socket.gethostname())
+        del task["lease"]
+        self._write("done", task)
+        self._remove(released)
+        return True
+
+    def fail(self, task, error):
+        released = self._release(task, "failed")
+        if released is None:
+            # the lease expired and the coordinator already requeued the task
+            return
+        self._retry(task, error)
+        self._remove(released)
+
+    def _retry(self, task, error):
+        task = dict(task, attempts=task["attempts"] + 1, error=error)
+        task.pop("lease", None)
+        self._write("failed" if task["attempts"] >= self.max_attempts else "pending", task)
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def requeue_expired(self):
+        """
+        requeue_expired: returns the tasks whose lease expired to pending/, or to failed/
+                         once they ran out of attempts. Returns the number of such tasks.
+                         Leases left in tmp/ by a worker that died while releasing them
+                         are recovered the same way.
+        """
+        requeued = 0
+        now = time.time()
+        stale = [("leased", lease) for lease in self._list("leased")]
+        stale += [
+            ("tmp", name)
+            for name in self._list("tmp")
+            if name.rsplit(".", 1)[-1] in RELEASED_SUFFIXES
+        ]
+        for state, lease in stale:
+            task_id = lease.split(".", 1)[0]
+            path = self._path(state, lease)
+            try:
+                if now - os.path.getmtime(path) < self.lease_timeout:
+                    continue
+                # take the lease away from the worker before requeueing it
+                expired = self._path("tmp", f"{task_id}.{os.getpid()}.expired")
+                os.rename(path, expired)
+            except FileNotFoundError:
+                continue
+
+            if not os.path.exists(self._path("done", task_id)):
+                self._retry(self._read(expired), "lease expired")
+                requeued += 1
+            self._remove(expired)
+
+        # partial task writes of a process that died, the task itself is still elsewhere
+        for name in self._list("tmp"):
+            path = self._path("tmp", name)
+            if name.rsplit(".", 1)[-1] not in RELEASED_SUFFIXES:
+                try:
+                    if now - os.path.getmtime(path) >= self.lease_timeout:
+                        self._remove(path)
+                except FileNotFoundError:
+                    pass
+        return requeued
+
+    def counts(self):
+        return {state: len(self._list(state)) for state in ("pending", "leased", "done", "failed")}
+
+    def finished(self):
+        """
+        finished: True once no task is pending, leased or being moved through tmp/,
+                  where complete() and fail() hold a task between releasing its lease
+                  and writing it to done/, pending/ or failed/.
+        """
+        counts = self.counts()
+        return counts["pending"] == 0 and counts["leased"] == 0 and not self._list("tmp")
+
+    def close(self):
+        open(os.path.join(self.root, "closed"), "w").close()
+
+
+def _heartbeat(queue, task, stop):
+    while not stop.wait(HEARTBEAT_INTERVAL):
+        try:
+            queue.renew(task)
+        except FileNotFoundError:
+            return
+
+
+def work(root, graph, poll_interval=POLL_INTERVAL):
+    """
+    work: keeps running tasks from the queue until it is closed.
+    """
+    import sb
+
+    sb.init_worker(graph)
+    queue = WorkQueue(root)
+    name = f"{socket.gethostname()}-{os.getpid()}"
+
+    while True:
+        task = queue.claim(name)
+        if task is None:
+            if queue.closed:
+                return
+            time.sleep(poll_interval)
+            continue
+
+        print(f"{bcolors.WARNING}👷 {name} running {task['id']}{bcolors.ENDC}", flush=True)
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=_heartbeat, args=(queue, task, stop), daemon=True)
+        heartbeat.start()
+        try:
+            worker = getattr(sb, task["worker"])
+            # results always go to the queue's result store
+            result = worker(**dict(task["kwargs"], out_dir=queue.results_dir))
+        except Exception:
+            queue.fail(task, traceback.format_exc())
+            print(f"{bcolors.FAIL}❌ {name} failed {task['id']}{bcolors.ENDC}", flush=True)
+        else:
+            if not queue.complete(task, result):
+                print(f"{bcolors.WARNING}⌛ {name} lost the lease of {task['id']}{bcolors.ENDC}", flush=True)
+        finally:
+            stop.set()
+            heartbeat.join()
+
+
+def run_workers(root, processes=1, shapefile=SHAPEFILE):
+    """
+    run_workers: loads the graph once and runs the given number of worker processes.
+    """
+    graph = load_graph(shapefile)
+    if processes == 1:
+        work(root, graph)
+        return
+
+    workers = [multiprocessing.Process(target=work, args=(root, graph)) for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def coordinate(root, lease_timeout=LEASE_TIMEOUT, poll_interval=POLL_INTERVAL):
+    """
+    coordinate: requeues expired leases until every task is done or failed, then closes the queue.
+    """
+    queue = WorkQueue(root, lease_timeout=lease_timeout)
+    while not queue.finished():
+        requeued = queue.requeue_expired()
+        if requeued:
+            print(f"{bcolors.WARNING}♻️  Requeued {requeued} expired tasks{bcolors.ENDC}", flush=True)
+        counts = queue.counts()
+        print(
+            f"{bcolors.OKCYAN}📋 pending: {counts['pending']}, leased: {counts['leased']}, "
+            f"done: {counts['done']}, failed: {counts['failed']}{bcolors.ENDC}",
+            flush=True,
+        )
+        time.sleep(poll_interval)
+
+    queue.close()
+    counts = queue.counts()
+    print(
+        f"{bcolors.OKGREEN}✅ {counts['done']} tasks done, {counts['failed']} failed, "
+        f"results in {queue.results_dir}{bcolors.ENDC}"
+    )
+
+
+def submit(root, config):
+    from runner import grid_tasks
+
+    tasks = []
+    for experiment in config["experiments"]:
+        if experiment["type"] == "ensemble":
+            print(f"{bcolors.WARNING}⚠️  Skipping ensemble experiment, run it with runner.py{bcolors.ENDC}")
+            continue
+        tasks.extend(grid_tasks(experiment))
+    submitted = WorkQueue(root).submit(tasks)
+    print(f"{bcolors.OKCYAN}📬 Submitted {submitted} tasks to {root}{bcolors.ENDC}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Distributed short burst sweeps.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    submit_parser = commands.add_parser("submit", help="add the tasks of a runner config to the queue")
+    submit_parser.add_argument("queue")
+    submit_parser.add_argument("config")
+
+    coordinator_parser = commands.add_parser("coordinator", help="requeue dead workers' tasks")
+    coordinator_parser.add_argument("queue")
+    coordinator_parser.add_argument("--lease-timeout", type=float, default=LEASE_TIMEOUT)
+
+    worker_parser = commands.add_parser("worker", help="run tasks from the queue")
+    worker_parser.add_argument("queue")
+    worker_parser.add_argument("--processes", type=int, default=1)
+    worker_parser.add_argument("--shapefile", default=SHAPEFILE)
+
+    local_parser = commands.add_parser("local", help="submit, work and coordinate on this machine")
+    local_parser.add_argument("queue")
+    local_parser.add_argument("config")
+    local_parser.add_argument("--workers", type=int, default=os.cpu_count())
+
+    args = parser.parse_args()
+    if args.command == "submit":
+        with open(args.config) as f_in:
+            submit(args.queue, json.load(f_in))
+    elif args.command == "coordinator":
+        coordinate(args.queue, lease_timeout=args.lease_timeout)
+    elif args.command == "worker":
+        run_workers(args.queue, args.processes, args.shapefile)
+    elif args.command == "local":
+        with open(args.config) as f_in:
+            config = json.load(f_in)
+        submit(args.queue, config)
+        local = multiprocessing.Process(
+            target=run_workers,
+            args=(args.queue, args.workers, config.get("shapefile", SHAPEFILE)),
+        )
+        local.start()
+        coordinate(args.queue)
+        local.join()